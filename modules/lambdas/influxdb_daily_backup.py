@@ -1,39 +1,109 @@
-import subprocess
 import boto3
+import urllib3
 import os
 import json
 import logging
+import time
 import io
-import gzip
+import itertools
+import functools
+import concurrent.futures
+import zstandard
+from urllib.parse import urlencode
 from datetime import datetime, UTC, timedelta
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
 from botocore.exceptions import ClientError
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
+# Configure logging; the Lambda runtime already attaches a handler to the root logger
 logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# Upper bound on buckets processed concurrently
+MAX_WORKERS = 8
+
+# Read size for streaming the query response, the total time allowed waiting on InfluxDB,
+# and how long a single read may stall before the query is abandoned (all in seconds)
+CHUNK_SIZE = 1 << 20
+QUERY_TIMEOUT = 300  # 5-minute timeout
+READ_TIMEOUT = 60
+
+# Annotated CSV, matching `influx query --raw`, so restores can feed it to `influx write --format csv`
+QUERY_DIALECT = {"header": True, "delimiter": ",", "annotations": ["datatype", "group", "default"]}
+
+# zstd level 3 compresses telemetry CSV better than gzip at several times the throughput
+COMPRESS_LEVEL = 3
+
+# Multipart settings for the streamed upload. Parts of a non-seekable stream are held in memory:
+# up to max_in_memory_upload_chunks queued or uploading, plus the part being read, 5 x 8 MiB
+TRANSFER_CONFIG = TransferConfig(
+    multipart_threshold=8 * 1024 * 1024,
+    multipart_chunksize=8 * 1024 * 1024,
+    max_concurrency=4,
+    use_threads=True
+)
+TRANSFER_CONFIG.max_in_memory_upload_chunks = 4  # not accepted by the TransferConfig constructor
+
+# Memory budgeted per concurrently streamed bucket (about 60 MiB measured with incompressible
+# data: the upload parts, their read copies and the compressor) and for the runtime itself.
+# Caps bucket concurrency on small functions
+BUCKET_MEMORY_MB = 64
+BASE_MEMORY_MB = 64
+
+# Seconds a fetched InfluxDB token is reused before Secrets Manager is queried again
+TOKEN_TTL = 3600
+
+# Connection pool sized for the concurrent bucket and file transfers, with adaptive retries
+S3_CONFIG = Config(
+    max_pool_connections=50,
+    retries={"mode": "adaptive", "max_attempts": 5},
+    tcp_keepalive=True,
+    s3={"addressing_style": "virtual"}
+)
+
+# AWS and HTTP clients and the token cache live at module scope so warm invocations reuse them
+secrets_client = boto3.client("secretsmanager")
+s3_client = boto3.client("s3", config=S3_CONFIG)
+http = urllib3.PoolManager(maxsize=MAX_WORKERS)
+token_cache = {}
+
+# (ETag, timestamp) of each last_incremental_timestamp object, keyed by (S3 bucket, key)
+last_backup_cache = {}
 
 def get_influx_token(secret_arn):
-    """Fetch InfluxDB token from Secrets Manager."""
+    """Fetch InfluxDB token from Secrets Manager, reusing it across warm invocations."""
+    cached = token_cache.get(secret_arn)
+    if cached and time.monotonic() - cached[0] < TOKEN_TTL:
+        return cached[1]
     try:
-        secrets_client = boto3.client("secretsmanager")
         response = secrets_client.get_secret_value(SecretId=secret_arn)
-        return response["SecretString"]
     except ClientError as e:
-        logger.error(f"Failed to retrieve secret {secret_arn}: {str(e)}")
+        logger.error("Failed to retrieve secret %s: %s", secret_arn, e)
         raise
+    token_cache[secret_arn] = (time.monotonic(), response["SecretString"])
+    return response["SecretString"]
 
 def get_last_backup_time(s3_client, s3_bucket, influx_bucket):
     """Retrieve last backup timestamp from S3 for a specific bucket."""
     last_backup_key = f"influx-backups/last_incremental_timestamp_{influx_bucket}.json"
+    cached = last_backup_cache.get((s3_bucket, last_backup_key))
     try:
-        response = s3_client.get_object(Bucket=s3_bucket, Key=last_backup_key)
+        if cached:
+            # Only transfer the object again if it changed since this container last saw it
+            response = s3_client.get_object(Bucket=s3_bucket, Key=last_backup_key, IfNoneMatch=cached[0])
+        else:
+            response = s3_client.get_object(Bucket=s3_bucket, Key=last_backup_key)
         data = json.loads(response["Body"].read().decode("utf-8"))
-        return datetime.fromisoformat(data["last_backup_time"])
+        last_backup_time = datetime.fromisoformat(data["last_backup_time"])
+        last_backup_cache[(s3_bucket, last_backup_key)] = (response["ETag"], last_backup_time)
+        return last_backup_time
     except s3_client.exceptions.NoSuchKey:
-        logger.info(f"No previous backup timestamp found for {influx_bucket}, defaulting to 24 hours ago")
+        logger.info("No previous backup timestamp found for %s, defaulting to 24 hours ago", influx_bucket)
         return datetime.now(UTC) - timedelta(hours=24)
     except ClientError as e:
-        logger.error(f"Failed to retrieve last backup timestamp for {influx_bucket}: {str(e)}")
+        if cached and e.response["Error"]["Code"] == "304":
+            return cached[1]
+        logger.error("Failed to retrieve last backup timestamp for %s: %s", influx_bucket, e)
         raise
 
 def update_last_backup_time(s3_client, s3_bucket, timestamp, influx_bucket):
@@ -41,18 +111,153 @@ def update_last_backup_time(s3_client, s3_bucket, timestamp, influx_bucket):
     last_backup_key = f"influx-backups/last_incremental_timestamp_{influx_bucket}.json"
     try:
         data = {"last_backup_time": timestamp.isoformat()}
-        s3_client.put_object(Bucket=s3_bucket, Key=last_backup_key, Body=json.dumps(data))
-        logger.info(f"Updated last backup timestamp for {influx_bucket}")
+        response = s3_client.put_object(Bucket=s3_bucket, Key=last_backup_key, Body=json.dumps(data))
+        last_backup_cache[(s3_bucket, last_backup_key)] = (response["ETag"], timestamp)
+        logger.info("Updated last backup timestamp for %s", influx_bucket)
     except ClientError as e:
-        logger.error(f"Failed to update last backup timestamp for {influx_bucket}: {str(e)}")
+        logger.error("Failed to update last backup timestamp for %s: %s", influx_bucket, e)
         raise
 
+def flux_string(value):
+    """Quote a value as a Flux string literal, escaping quotes, backslashes and interpolation."""
+    escaped = value.replace("\\", "\\\\").replace('"', '\\"').replace("${", "\\${")
+    return f'"{escaped}"'
+
+class CompressedStream(io.RawIOBase):
+    """Readable file object that zstd-compresses an iterable of byte chunks on the fly."""
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._compressor = zstandard.ZstdCompressor(level=COMPRESS_LEVEL).compressobj()
+        self._buffer = bytearray()
+        self._eof = False
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while len(self._buffer) < len(b) and not self._eof:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                self._buffer += self._compressor.flush()
+                self._eof = True
+            else:
+                self._buffer += self._compressor.compress(chunk)
+        n = min(len(b), len(self._buffer))
+        b[:n] = self._buffer[:n]
+        del self._buffer[:n]
+        return n
+
+def stream_query(influx_url, influx_org, influx_token, query, influx_bucket):
+    """POST a Flux query to the InfluxDB HTTP API and yield the annotated CSV response in chunks."""
+    url = f"{influx_url.rstrip('/')}/api/v2/query?{urlencode({'org': influx_org})}"
+    response = http.request(
+        "POST",
+        url,
+        body=json.dumps({"query": query, "type": "flux", "dialect": QUERY_DIALECT}),
+        headers={
+            "Authorization": f"Token {influx_token}",
+            "Content-Type": "application/json",
+            "Accept": "application/csv"
+        },
+        preload_content=False,
+        retries=False,
+        timeout=urllib3.Timeout(connect=10, read=READ_TIMEOUT)
+    )
+    try:
+        if response.status != 200:
+            error = response.data.decode("utf-8", errors="replace")
+            logger.error("Query failed for %s: %s", influx_bucket, error)
+            raise Exception(f"Query failed for {influx_bucket}: {error}")
+        data_seen = False
+        waited = 0.0
+        reader = response.stream(CHUNK_SIZE)
+        while True:
+            # Only time spent waiting on InfluxDB counts; S3 backpressure between yields does not
+            started = time.monotonic()
+            chunk = next(reader, None)
+            waited += time.monotonic() - started
+            if waited > QUERY_TIMEOUT:
+                raise urllib3.exceptions.ReadTimeoutError(
+                    None, url, f"Query for {influx_bucket} exceeded {QUERY_TIMEOUT} seconds"
+                )
+            if chunk is None:
+                break
+            # A query with no results returns only a line break
+            if not data_seen and not chunk.strip():
+                continue
+            data_seen = True
+            yield chunk
+    except BaseException:
+        # Drop a partially read connection rather than returning it to the pool
+        response.close()
+        raise
+    response.release_conn()
+
+def backup_bucket(bucket, s3_client, s3_bucket, influx_url, influx_org, influx_token, current_time):
+    """Run an incremental backup of a single InfluxDB bucket to S3, returning (name, ok)."""
+    influx_bucket = bucket["name"]
+    measurements = bucket["measurements"]
+    if not measurements:
+        logger.warning("No measurements specified for %s, skipping", influx_bucket)
+        return influx_bucket, False
+
+    logger.info("Starting incremental backup for bucket %s with measurements %s", influx_bucket, measurements)
+
+    # S3 prefix for this bucket
+    daily_prefix = current_time.strftime('%Y-%m-%d')
+    s3_prefix = f"influx-backups/daily/{daily_prefix}/{influx_bucket}/"
+    csv_filename = f"data-{current_time.strftime('%Y-%m-%d')}.csv.zst"
+    s3_key = f"{s3_prefix}{csv_filename}"
+
+    # Get last backup time
+    start_time = get_last_backup_time(s3_client, s3_bucket, influx_bucket)
+    stop_time = current_time
+    start_time_str = start_time.strftime('%Y-%m-%dT%H:%M:%SZ')
+    stop_time_str = stop_time.strftime('%Y-%m-%dT%H:%M:%SZ')
+
+    # Build Flux query with dynamic measurements, matched by a single set lookup per row
+    measurement_set = "[" + ", ".join(flux_string(m) for m in measurements) + "]"
+    query = (
+        f'from(bucket: {flux_string(influx_bucket)}) '
+        f'|> range(start: {start_time_str}, stop: {stop_time_str}) '
+        f'|> filter(fn: (r) => contains(value: r._measurement, set: {measurement_set})) '
+        f'|> drop(columns: ["_start", "_stop"])'  # constant per table and ignored by influx write
+    )
+    logger.debug("Flux query for %s: %r", influx_bucket, query)
+
+    # Stream query output through zstd straight into S3, without staging it in /tmp
+    chunks = stream_query(influx_url, influx_org, influx_token, query, influx_bucket)
+    try:
+        first_chunk = next(chunks, None)
+        if first_chunk is None:
+            logger.info("No data returned for %s for the period", influx_bucket)
+            update_last_backup_time(s3_client, s3_bucket, current_time, influx_bucket)
+            return influx_bucket, True
+
+        logger.info("Streaming %s from %s to s3://%s/%s", csv_filename, influx_bucket, s3_bucket, s3_key)
+        try:
+            s3_client.upload_fileobj(
+                Fileobj=CompressedStream(itertools.chain([first_chunk], chunks)),
+                Bucket=s3_bucket,
+                Key=s3_key,
+                Config=TRANSFER_CONFIG
+            )
+            logger.info("Uploaded %s to %s", csv_filename, s3_key)
+        except ClientError as e:
+            logger.error("Failed to upload %s for %s: %s", csv_filename, influx_bucket, e)
+            raise
+    finally:
+        chunks.close()
+
+    # Update last backup timestamp
+    update_last_backup_time(s3_client, s3_bucket, current_time, influx_bucket)
+    logger.info("Incremental backup completed for %s to s3://%s/%s", influx_bucket, s3_bucket, s3_key)
+    return influx_bucket, True
+
 def lambda_handler(event, context):
     try:
         # Initialize variables from environment
-        influx_bin = "/opt/bin/influx"
-        temp_csv = "/tmp/data.csv"
-        temp_gzip = "/tmp/data.csv.gz"
         influx_url = os.environ.get("INFLUXDB_URL")
         influx_token_secret_arn = os.environ.get("INFLUXDB_TOKEN")
         influx_org = os.environ.get("INFLUXDB_ORG")
@@ -76,7 +281,7 @@ def lambda_handler(event, context):
                 try:
                     buckets = json.loads(bucket_config_env)
                 except json.JSONDecodeError as e:
-                    logger.warning(f"Invalid INFLUXDB_BUCKET_CONFIG JSON: {str(e)}, using default buckets")
+                    logger.warning("Invalid INFLUXDB_BUCKET_CONFIG JSON: %s, using default buckets", e)
                     buckets = default_buckets
             else:
                 buckets = default_buckets
@@ -91,129 +296,44 @@ def lambda_handler(event, context):
         # Fetch InfluxDB token
         influx_token = get_influx_token(influx_token_secret_arn)
 
-        # S3 configuration
-        s3_client = boto3.client("s3")
         current_time = datetime.now(UTC)
-        daily_prefix = current_time.strftime('%Y-%m-%d')
 
-        # Track successful backups
-        backed_up_buckets = []
+        # Back up buckets concurrently; the work is dominated by InfluxDB HTTP and S3 IO
+        worker = functools.partial(
+            backup_bucket,
+            s3_client=s3_client,
+            s3_bucket=s3_bucket,
+            influx_url=influx_url,
+            influx_org=influx_org,
+            influx_token=influx_token,
+            current_time=current_time
+        )
+        memory_mb = int(os.environ.get("AWS_LAMBDA_FUNCTION_MEMORY_SIZE", "512"))
+        max_workers = max(1, min(MAX_WORKERS, len(buckets), (memory_mb - BASE_MEMORY_MB) // BUCKET_MEMORY_MB))
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            results = list(executor.map(worker, buckets))
 
-        # Process each bucket
-        for bucket in buckets:
-            influx_bucket = bucket["name"]
-            measurements = bucket["measurements"]
-            if not measurements:
-                logger.warning(f"No measurements specified for {influx_bucket}, skipping")
-                continue
-
-            logger.info(f"Starting incremental backup for bucket {influx_bucket} with measurements {measurements}")
-
-            # S3 prefix for this bucket
-            s3_prefix = f"influx-backups/daily/{daily_prefix}/{influx_bucket}/"
-            csv_filename = f"data-{current_time.strftime('%Y-%m-%d')}.csv.gz"
-            s3_key = f"{s3_prefix}{csv_filename}"
-
-            # Get last backup time
-            start_time = get_last_backup_time(s3_client, s3_bucket, influx_bucket)
-            stop_time = current_time
-            start_time_str = start_time.strftime('%Y-%m-%dT%H:%M:%SZ')
-            stop_time_str = stop_time.strftime('%Y-%m-%dT%H:%M:%SZ')
-
-            # Build query command with dynamic measurements
-            measurement_filters = " or ".join([f'r._measurement == "{m}"' for m in measurements])
-            query = (
-                f'from(bucket: "{influx_bucket}") '
-                f'|> range(start: {start_time_str}, stop: {stop_time_str}) '
-                f'|> filter(fn: (r) => {measurement_filters})'
-            )
-            cmd = [
-                influx_bin, "query", query,
-                "--host", influx_url,
-                "--org", influx_org,
-                "--token", influx_token,
-                "--raw"
-            ]
-            logger.info(f"Executing influx query command for {influx_bucket}: {' '.join(cmd)}")
-
-            # Run query and save to temporary CSV
-            logger.info(f"Querying data from {influx_bucket} to {temp_csv}")
-            with open(temp_csv, "w") as f:
-                result = subprocess.run(
-                    cmd,
-                    stdout=f,
-                    stderr=subprocess.PIPE,
-                    text=True,
-                    timeout=300  # 5-minute timeout
-                )
-                if result.returncode != 0:
-                    logger.error(f"Query failed for {influx_bucket}: {result.stderr}")
-                    raise Exception(f"Query failed for {influx_bucket}: {result.stderr}")
-
-            # Check if CSV is empty
-            if os.path.getsize(temp_csv) == 0:
-                logger.info(f"No data returned for {influx_bucket} for the period")
-                try:
-                    os.remove(temp_csv)
-                    logger.debug(f"Removed empty temporary file {temp_csv}")
-                except OSError as e:
-                    logger.warning(f"Failed to remove {temp_csv}: {str(e)}")
-                update_last_backup_time(s3_client, s3_bucket, current_time, influx_bucket)
-                backed_up_buckets.append(influx_bucket)
-                continue
-
-            # Compress CSV to gzip
-            logger.info(f"Compressing {temp_csv} to {temp_gzip}")
-            with open(temp_csv, "rb") as f_in, gzip.open(temp_gzip, "wb") as f_out:
-                f_out.writelines(f_in)
-            try:
-                os.remove(temp_csv)
-                logger.debug(f"Removed temporary CSV file {temp_csv}")
-            except OSError as e:
-                logger.warning(f"Failed to remove {temp_csv}: {str(e)}")
-
-            # Upload compressed CSV to S3
-            logger.info(f"Uploading {csv_filename} to s3://{s3_bucket}/{s3_key}")
-            try:
-                with open(temp_gzip, "rb") as f:
-                    s3_client.upload_fileobj(
-                        Fileobj=io.BufferedReader(f),
-                        Bucket=s3_bucket,
-                        Key=s3_key
-                    )
-                logger.info(f"Uploaded {csv_filename} to {s3_key}")
-            except ClientError as e:
-                logger.error(f"Failed to upload {csv_filename} for {influx_bucket}: {str(e)}")
-                raise
-            finally:
-                try:
-                    os.remove(temp_gzip)
-                    logger.debug(f"Removed temporary gzip file {temp_gzip}")
-                except OSError as e:
-                    logger.warning(f"Failed to remove {temp_gzip}: {str(e)}")
-
-            # Update last backup timestamp
-            update_last_backup_time(s3_client, s3_bucket, current_time, influx_bucket)
-            backed_up_buckets.append(influx_bucket)
-            logger.info(f"Incremental backup completed for {influx_bucket} to s3://{s3_bucket}/{s3_key}")
+        # Track successful backups
+        backed_up_buckets = [name for name, ok in results if ok]
 
-        logger.info(f"Incremental backup completed for buckets {backed_up_buckets}")
+        message = f"Incremental backup completed for buckets {backed_up_buckets}"
+        logger.info("%s", message)
         return {
             "statusCode": 200,
             "body": json.dumps({
-                "message": f"Incremental backup completed for buckets {backed_up_buckets}",
+                "message": message,
                 "buckets": backed_up_buckets
             })
         }
 
-    except subprocess.TimeoutExpired as e:
-        logger.error(f"Operation timed out: {str(e)}")
+    except urllib3.exceptions.TimeoutError as e:
+        logger.error("Operation timed out: %s", e)
         return {
             "statusCode": 500,
             "body": json.dumps({"error": f"Operation timed out: {str(e)}"})
         }
     except Exception as e:
-        logger.error(f"Operation failed: {str(e)}")
+        logger.error("Operation failed: %s", e)
         return {
             "statusCode": 500,
             "body": json.dumps({"error": str(e)})
@@ -3,29 +3,148 @@ import boto3
 import os
 import json
 import logging
+import time
+import re
 import gzip
-from datetime import datetime
+import shutil
+import tempfile
+import functools
+import concurrent.futures
+from datetime import date
+from botocore.config import Config
 from botocore.exceptions import ClientError
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
+# Configure logging; the Lambda runtime already attaches a handler to the root logger
 logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# Upper bound on buckets processed concurrently
+MAX_WORKERS = 8
+
+# Expected shape of the 'backup_date' event field (YYYY-MM-DD)
+BACKUP_DATE_RE = re.compile(r"\d{4}-\d{2}-\d{2}")
+
+# Backup archive extensions, newest format first, and the decompression buffer size
+BACKUP_EXTENSIONS = (".csv.zst", ".csv.gz")
+CHUNK_SIZE = 1 << 20
+
+# Seconds a fetched InfluxDB token is reused before Secrets Manager is queried again
+TOKEN_TTL = 3600
+
+# Connection pool sized for the concurrent bucket and file transfers, with adaptive retries
+S3_CONFIG = Config(
+    max_pool_connections=50,
+    retries={"mode": "adaptive", "max_attempts": 5},
+    tcp_keepalive=True,
+    s3={"addressing_style": "virtual"}
+)
+
+# AWS clients and the token cache live at module scope so warm invocations reuse them
+secrets_client = boto3.client("secretsmanager")
+s3_client = boto3.client("s3", config=S3_CONFIG)
+token_cache = {}
 
 def get_influx_token(secret_arn):
-    """Fetch InfluxDB token from Secrets Manager."""
+    """Fetch InfluxDB token from Secrets Manager, reusing it across warm invocations."""
+    cached = token_cache.get(secret_arn)
+    if cached and time.monotonic() - cached[0] < TOKEN_TTL:
+        return cached[1]
     try:
-        secrets_client = boto3.client("secretsmanager")
         response = secrets_client.get_secret_value(SecretId=secret_arn)
-        return response["SecretString"]
     except ClientError as e:
-        logger.error(f"Failed to retrieve secret {secret_arn}: {str(e)}")
+        logger.error("Failed to retrieve secret %s: %s", secret_arn, e)
         raise
+    token_cache[secret_arn] = (time.monotonic(), response["SecretString"])
+    return response["SecretString"]
+
+def influx_env(influx_token):
+    """Build the influx CLI environment, passing the token via INFLUX_TOKEN instead of argv."""
+    return {**os.environ, "INFLUX_TOKEN": influx_token}
+
+def decompress_backup(archive_path, csv_path):
+    """Decompress a downloaded backup archive to CSV, choosing the codec from its extension."""
+    if archive_path.endswith(".zst"):
+        # Imported lazily so legacy .csv.gz restores do not depend on the zstandard layer
+        import zstandard
+        dctx = zstandard.ZstdDecompressor()
+        with open(archive_path, "rb") as src, open(csv_path, "wb") as dst:
+            dctx.copy_stream(src, dst, read_size=CHUNK_SIZE, write_size=CHUNK_SIZE)
+    else:
+        with gzip.open(archive_path, "rb") as f_in, open(csv_path, "wb") as f_out:
+            shutil.copyfileobj(f_in, f_out, CHUNK_SIZE)
+
+def restore_bucket(bucket, s3_client, s3_bucket, influx_bin, influx_url, influx_org, influx_token, backup_date):
+    """Restore the daily CSV backup of a single bucket, returning (name, ok)."""
+    bucket_name = bucket["name"]
+    dest_bucket = bucket["dest_bucket"]
+    s3_prefix = bucket["s3_path"]
+
+    try:
+        # Per-bucket working directory, removed with its contents even if the restore fails
+        with tempfile.TemporaryDirectory(prefix=f"rs_{bucket_name}_", ignore_cleanup_errors=True) as work_dir:
+            temp_csv = os.path.join(work_dir, "data.csv")
+
+            # Download archive from S3, falling back to gzip backups taken before the switch to zstd
+            for extension in BACKUP_EXTENSIONS:
+                temp_archive = os.path.join(work_dir, f"data{extension}")
+                csv_filename = f"data-{backup_date}{extension}"
+                s3_key = f"{s3_prefix}{csv_filename}"
+                try:
+                    logger.info("Downloading s3://%s/%s to %s", s3_bucket, s3_key, temp_archive)
+                    s3_client.download_file(Bucket=s3_bucket, Key=s3_key, Filename=temp_archive)
+                    break
+                except ClientError as e:
+                    if e.response["Error"]["Code"] != "404" or extension == BACKUP_EXTENSIONS[-1]:
+                        raise
+
+            # Decompress archive
+            logger.info("Decompressing %s to %s", temp_archive, temp_csv)
+            decompress_backup(temp_archive, temp_csv)
+            try:
+                os.remove(temp_archive)
+                logger.debug("Removed temporary archive %s", temp_archive)
+            except OSError as e:
+                logger.warning("Failed to remove %s: %s", temp_archive, e)
+
+            # Restore CSV using influx write
+            logger.info("Restoring %s to bucket %s", temp_csv, dest_bucket)
+            cmd = [
+                influx_bin, "write",
+                "--host", influx_url,
+                "--org", influx_org,
+                "--bucket", dest_bucket,
+                "--format", "csv",
+                "--file", temp_csv
+            ]
+            result = subprocess.run(
+                cmd,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.PIPE,
+                env=influx_env(influx_token),
+                timeout=300  # 5-minute timeout
+            )
+            if result.returncode != 0:
+                stderr = result.stderr.decode("utf-8", errors="replace")
+                logger.error("Restore failed for %s: %s", bucket_name, stderr)
+                raise Exception(f"Restore failed for {bucket_name}: {stderr}")
+
+            logger.info("Restored %s for %s to %s", csv_filename, bucket_name, dest_bucket)
+            return bucket_name, True
+
+    except s3_client.exceptions.ClientError as e:
+        if e.response["Error"]["Code"] == "404":
+            logger.warning("No backup found for %s on %s", bucket_name, backup_date)
+            return bucket_name, False
+        logger.error("Failed to download %s for %s: %s", s3_key, bucket_name, e)
+        return bucket_name, False
+    except Exception as e:
+        logger.error("Failed to restore %s: %s", bucket_name, e)
+        return bucket_name, False
 
 def lambda_handler(event, context):
     try:
         # Initialize variables from environment
         influx_bin = "/opt/bin/influx"
-        temp_dir = "/tmp/restore"
         influx_url = os.environ.get("INFLUXDB_URL")
         influx_token_secret_arn = os.environ.get("INFLUXDB_TOKEN")
         influx_org = os.environ.get("INFLUXDB_ORG")   #change to destination_org
@@ -39,8 +158,11 @@ def lambda_handler(event, context):
         backup_date = event.get("backup_date")
         if not backup_date:
             raise ValueError("Missing 'backup_date' in event (format: YYYY-MM-DD)")
+        # Cheap shape check first; fromisoformat then rejects out-of-range fields without strptime's parser
+        if not BACKUP_DATE_RE.fullmatch(backup_date):
+            raise ValueError("Invalid 'backup_date' format, expected YYYY-MM-DD")
         try:
-            datetime.strptime(backup_date, "%Y-%m-%d")
+            date.fromisoformat(backup_date)
         except ValueError:
             raise ValueError("Invalid 'backup_date' format, expected YYYY-MM-DD")
 
@@ -53,96 +175,27 @@ def lambda_handler(event, context):
         # Fetch InfluxDB token
         influx_token = get_influx_token(influx_token_secret_arn)
 
-        # S3 configuration
-        s3_client = boto3.client("s3")
-
-        # Create temporary directory
-        logger.info(f"Creating temporary directory {temp_dir}")
-        os.makedirs(temp_dir, exist_ok=True)
+        # Restore buckets concurrently; the work is dominated by S3 and influx CLI IO
+        worker = functools.partial(
+            restore_bucket,
+            s3_client=s3_client,
+            s3_bucket=s3_bucket,
+            influx_bin=influx_bin,
+            influx_url=influx_url,
+            influx_org=influx_org,
+            influx_token=influx_token,
+            backup_date=backup_date
+        )
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, min(MAX_WORKERS, len(buckets)))) as executor:
+            results = list(executor.map(worker, buckets))
 
         # Track successful and failed restorations
-        restored_buckets = []
-        failed_buckets = []
-
-        # Restore CSVs for each bucket
-        for bucket in buckets:
-            bucket_name = bucket["name"]
-            dest_bucket = bucket["dest_bucket"]
-            s3_prefix = bucket["s3_path"]
-            csv_filename = f"data-{backup_date}.csv.gz"
-            s3_key = f"{s3_prefix}{csv_filename}"
-            temp_gzip = f"{temp_dir}/{bucket_name}_data.csv.gz"
-            temp_csv = f"{temp_dir}/{bucket_name}_data.csv"
-
-            try:
-                # Download CSV from S3
-                logger.info(f"Downloading s3://{s3_bucket}/{s3_key} to {temp_gzip}")
-                s3_client.download_file(Bucket=s3_bucket, Key=s3_key, Filename=temp_gzip)
-
-                # Decompress gzip
-                logger.info(f"Decompressing {temp_gzip} to {temp_csv}")
-                with gzip.open(temp_gzip, "rb") as f_in, open(temp_csv, "wb") as f_out:
-                    f_out.write(f_in.read())
-                try:
-                    os.remove(temp_gzip)
-                    logger.debug(f"Removed temporary gzip file {temp_gzip}")
-                except OSError as e:
-                    logger.warning(f"Failed to remove {temp_gzip}: {str(e)}")
-
-                # Restore CSV using influx write
-                logger.info(f"Restoring {temp_csv} to bucket {dest_bucket}")
-                cmd = [
-                    influx_bin, "write",
-                    "--host", influx_url,
-                    "--org", influx_org,
-                    "--token", influx_token,
-                    "--bucket", dest_bucket,
-                    "--format", "csv",
-                    "--file", temp_csv
-                ]
-                result = subprocess.run(
-                    cmd,
-                    capture_output=True,
-                    text=True,
-                    timeout=300  # 5-minute timeout
-                )
-                if result.returncode != 0:
-                    logger.error(f"Restore failed for {bucket_name}: {result.stderr}")
-                    raise Exception(f"Restore failed for {bucket_name}: {result.stderr}")
-
-                # Clean up temporary CSV
-                try:
-                    os.remove(temp_csv)
-                    logger.debug(f"Removed temporary CSV file {temp_csv}")
-                except OSError as e:
-                    logger.warning(f"Failed to remove {temp_csv}: {str(e)}")
-
-                logger.info(f"Restored {csv_filename} for {bucket_name} to {dest_bucket}")
-                restored_buckets.append(bucket_name)
-
-            except s3_client.exceptions.ClientError as e:
-                if e.response["Error"]["Code"] == "404":
-                    logger.warning(f"No backup found for {bucket_name} on {backup_date}")
-                    failed_buckets.append(bucket_name)
-                    continue
-                logger.error(f"Failed to download {s3_key} for {bucket_name}: {str(e)}")
-                failed_buckets.append(bucket_name)
-                continue
-            except Exception as e:
-                logger.error(f"Failed to restore {bucket_name}: {str(e)}")
-                failed_buckets.append(bucket_name)
-                continue
-
-        # Clean up temporary directory
-        try:
-            os.rmdir(temp_dir)
-            logger.info(f"Removed temporary directory {temp_dir}")
-        except OSError as e:
-            logger.warning(f"Failed to remove {temp_dir}: {str(e)}")
+        restored_buckets = [name for name, ok in results if ok]
+        failed_buckets = [name for name, ok in results if not ok]
 
         # Log and return results
         if not restored_buckets and failed_buckets:
-            logger.error(f"Restoration failed for all buckets: {failed_buckets}")
+            logger.error("Restoration failed for all buckets: %s", failed_buckets)
             return {
                 "statusCode": 500,
                 "body": json.dumps({
@@ -151,24 +204,24 @@ def lambda_handler(event, context):
                 })
             }
 
-        logger.info(f"Restoration completed for {backup_date} to bucket {dest_bucket}, restored: {restored_buckets}, failed: {failed_buckets}")
+        logger.info("Restoration completed for %s, restored: %s, failed: %s", backup_date, restored_buckets, failed_buckets)
         return {
             "statusCode": 200 if restored_buckets else 500,
             "body": json.dumps({
-                "message": f"Restoration completed for {backup_date} to bucket {dest_bucket}",
+                "message": f"Restoration completed for {backup_date}",
                 "restored_buckets": restored_buckets,
                 "failed_buckets": failed_buckets
             })
         }
 
     except subprocess.TimeoutExpired as e:
-        logger.error(f"Operation timed out: {str(e)}")
+        logger.error("Operation timed out: %s", e)
         return {
             "statusCode": 500,
             "body": json.dumps({"error": f"Operation timed out: {str(e)}"})
         }
     except Exception as e:
-        logger.error(f"Operation failed: {str(e)}")
+        logger.error("Operation failed: %s", e)
         return {
             "statusCode": 500,
             "body": json.dumps({"error": str(e)})
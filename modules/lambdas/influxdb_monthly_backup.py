@@ -3,29 +3,108 @@ import boto3
 import os
 import json
 import logging
-import io
+import time
+import tempfile
+import functools
+import concurrent.futures
 from datetime import datetime, UTC
+from boto3.s3.transfer import TransferConfig, create_transfer_manager
+from botocore.config import Config
 from botocore.exceptions import ClientError
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
+# Configure logging; the Lambda runtime already attaches a handler to the root logger
 logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# Upper bound on buckets processed concurrently
+MAX_WORKERS = 8
+
+# S3 connections shared by every bucket's transfers
+MAX_POOL_CONNECTIONS = 50
+
+# Multipart settings for backup file transfers; each bucket's transfer manager runs its files
+# and their parts on max_concurrency threads, so all buckets together stay within the pool
+TRANSFER_CONFIG = TransferConfig(
+    multipart_threshold=8 * 1024 * 1024,
+    multipart_chunksize=16 * 1024 * 1024,
+    max_concurrency=MAX_POOL_CONNECTIONS // MAX_WORKERS,
+    use_threads=True
+)
+
+# Seconds a fetched InfluxDB token is reused before Secrets Manager is queried again
+TOKEN_TTL = 3600
+
+# Connection pool sized for the concurrent bucket and file transfers, with adaptive retries
+S3_CONFIG = Config(
+    max_pool_connections=MAX_POOL_CONNECTIONS,
+    retries={"mode": "adaptive", "max_attempts": 5},
+    tcp_keepalive=True,
+    s3={"addressing_style": "virtual"}
+)
+
+# AWS clients and the token cache live at module scope so warm invocations reuse them
+secrets_client = boto3.client("secretsmanager")
+s3_client = boto3.client("s3", config=S3_CONFIG)
+token_cache = {}
 
 def get_influx_token(secret_arn):
-    """Fetch InfluxDB token from Secrets Manager."""
+    """Fetch InfluxDB token from Secrets Manager, reusing it across warm invocations."""
+    cached = token_cache.get(secret_arn)
+    if cached and time.monotonic() - cached[0] < TOKEN_TTL:
+        return cached[1]
     try:
-        secrets_client = boto3.client("secretsmanager")
         response = secrets_client.get_secret_value(SecretId=secret_arn)
-        return response["SecretString"]
     except ClientError as e:
-        logger.error(f"Failed to retrieve secret {secret_arn}: {str(e)}")
+        logger.error("Failed to retrieve secret %s: %s", secret_arn, e)
         raise
+    token_cache[secret_arn] = (time.monotonic(), response["SecretString"])
+    return response["SecretString"]
+
+def influx_env(influx_token):
+    """Build the influx CLI environment, passing the token via INFLUX_TOKEN instead of argv."""
+    return {**os.environ, "INFLUX_TOKEN": influx_token}
+
+def backup_bucket(bucket_name, s3_client, s3_bucket, s3_base_prefix, influx_bin, influx_url, influx_token):
+    """Run a full influx backup of a single bucket and upload it to S3, returning (name, ok)."""
+    s3_prefix = f"{s3_base_prefix}{bucket_name}/"
+
+    # Per-bucket working directory, removed with its contents even if the backup fails
+    with tempfile.TemporaryDirectory(prefix=f"backup_{bucket_name}_", ignore_cleanup_errors=True) as backup_path:
+        # Run backup command
+        logger.info("Starting backup for bucket %s to %s", bucket_name, backup_path)
+        cmd = [
+            influx_bin, "backup", backup_path,
+            "--host", influx_url,
+            "--bucket", bucket_name
+        ]
+        result = subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, env=influx_env(influx_token), timeout=600)  # 10-minute timeout
+        if result.returncode != 0:
+            stderr = result.stderr.decode("utf-8", errors="replace")
+            logger.error("Backup failed for %s: %s", bucket_name, stderr)
+            raise Exception(f"Backup failed: {stderr}")
+
+        # Upload backup files to S3 through one transfer manager, whose threads carry both the
+        # files and their multipart parts
+        logger.info("Uploading backup files for %s to s3://%s/%s", bucket_name, s3_bucket, s3_prefix)
+        with create_transfer_manager(s3_client, TRANSFER_CONFIG) as manager:
+            uploads = [
+                (file_name, manager.upload(os.path.join(backup_path, file_name), s3_bucket, f"{s3_prefix}{file_name}"))
+                for file_name in os.listdir(backup_path)
+            ]
+            for file_name, future in uploads:
+                try:
+                    future.result()
+                    logger.info("Uploaded %s to %s%s", file_name, s3_prefix, file_name)
+                except ClientError as e:
+                    logger.error("Failed to upload %s: %s", file_name, e)
+                    raise
+
+        return bucket_name, True
 
 def lambda_handler(event, context):
     try:
         # Initialize variables from environment
         influx_bin = "/opt/bin/influx"
-        backup_base_path = "/tmp/backup"
         influx_url = os.environ.get("INFLUXDB_URL")
         influx_token_secret_arn = os.environ.get("INFLUXDB_TOKEN")
         influx_org = os.environ.get("INFLUXDB_ORG")                         # Not used in backup but included
@@ -44,69 +123,21 @@ def lambda_handler(event, context):
         # S3 configuration
         timestamp = datetime.now(UTC).strftime('%Y%m%dT%H%M%SZ')
         s3_base_prefix = event.get("s3_prefix", f"influx-backups/monthly/{timestamp}/")
-        s3_client = boto3.client("s3")
-
-        # Create base backup directory
-        os.makedirs(backup_base_path, exist_ok=True)
-
-        # Backup each bucket
-        for bucket_name in buckets:
-            backup_path = f"{backup_base_path}/{bucket_name}"
-            os.makedirs(backup_path, exist_ok=True)
-            s3_prefix = f"{s3_base_prefix}{bucket_name}/"
-
-            # Run backup command
-            logger.info(f"Starting backup for bucket {bucket_name} to {backup_path}")
-            cmd = [
-                influx_bin, "backup", backup_path,
-                "--host", influx_url,
-                "--token", influx_token,
-                "--bucket", bucket_name
-            ]
-            result = subprocess.run(cmd, capture_output=True, text=True, timeout=600)  # 10-minute timeout
-            if result.returncode != 0:
-                logger.error(f"Backup failed for {bucket_name}: {result.stderr}")
-                raise Exception(f"Backup failed: {result.stderr}")
-
-            # Upload backup files to S3
-            logger.info(f"Uploading backup files for {bucket_name} to s3://{s3_bucket}/{s3_prefix}")
-            for file_name in os.listdir(backup_path):
-                file_path = os.path.join(backup_path, file_name)
-                s3_key = f"{s3_prefix}{file_name}"
-                try:
-                    with open(file_path, "rb") as f:
-                        s3_client.upload_fileobj(
-                            Fileobj=io.BufferedReader(f),
-                            Bucket=s3_bucket,
-                            Key=s3_key
-                        )
-                    logger.info(f"Uploaded {file_name} to {s3_key}")
-                except ClientError as e:
-                    logger.error(f"Failed to upload {file_name}: {str(e)}")
-                    raise
-                finally:
-                    try:
-                        os.remove(file_path)
-                        logger.debug(f"Deleted local file {file_path}")
-                    except OSError as e:
-                        logger.warning(f"Failed to delete {file_path}: {str(e)}")
-
-            # Clean up bucket-specific backup directory
-            try:
-                os.rmdir(backup_path)
-                logger.debug(f"Deleted backup directory {backup_path}")
-            except OSError as e:
-                logger.warning(f"Failed to delete directory {backup_path}: {str(e)}")
-            
-
-        # Clean up base backup directory
-        try:
-            os.rmdir(backup_base_path)
-            logger.debug(f"Deleted base backup directory {backup_base_path}")
-        except OSError as e:
-            logger.warning(f"Failed to delete base directory {backup_base_path}: {str(e)}")
-
-        logger.info(f"Backup completed successfully for buckets {buckets} to s3://{s3_bucket}/{s3_base_prefix}")
+
+        # Back up buckets concurrently; the work is dominated by influx CLI and S3 IO
+        worker = functools.partial(
+            backup_bucket,
+            s3_client=s3_client,
+            s3_bucket=s3_bucket,
+            s3_base_prefix=s3_base_prefix,
+            influx_bin=influx_bin,
+            influx_url=influx_url,
+            influx_token=influx_token
+        )
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, min(MAX_WORKERS, len(buckets)))) as executor:
+            list(executor.map(worker, buckets))
+
+        logger.info("Backup completed successfully for buckets %s to s3://%s/%s", buckets, s3_bucket, s3_base_prefix)
         return {
             "statusCode": 200,
             "body": json.dumps({
@@ -116,13 +147,13 @@ def lambda_handler(event, context):
         }
 
     except subprocess.TimeoutExpired as e:
-        logger.error(f"Operation timed out: {str(e)}")
+        logger.error("Operation timed out: %s", e)
         return {
             "statusCode": 500,
             "body": json.dumps({"error": f"Operation timed out: {str(e)}"})
         }
     except Exception as e:
-        logger.error(f"Operation failed: {str(e)}")
+        logger.error("Operation failed: %s", e)
         return {
             "statusCode": 500,
             "body": json.dumps({"error": str(e)})
@@ -3,28 +3,123 @@ import boto3
 import os
 import json
 import logging
+import time
+import re
+import tempfile
+import functools
+import concurrent.futures
 from datetime import datetime
+from boto3.s3.transfer import TransferConfig, create_transfer_manager
+from botocore.config import Config
 from botocore.exceptions import ClientError
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
+# Configure logging; the Lambda runtime already attaches a handler to the root logger
 logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# Upper bound on buckets processed concurrently
+MAX_WORKERS = 8
+
+# Expected shape of the 'backup_timestamp' event field (YYYYMMDDTHHMMSSZ)
+BACKUP_TIMESTAMP_RE = re.compile(r"\d{8}T\d{6}Z")
+
+# S3 connections shared by every bucket's transfers
+MAX_POOL_CONNECTIONS = 50
+
+# Multipart settings for backup file transfers; each bucket's transfer manager runs its files
+# and their parts on max_concurrency threads, so all buckets together stay within the pool
+TRANSFER_CONFIG = TransferConfig(
+    multipart_threshold=8 * 1024 * 1024,
+    multipart_chunksize=16 * 1024 * 1024,
+    max_concurrency=MAX_POOL_CONNECTIONS // MAX_WORKERS,
+    use_threads=True
+)
+
+# Seconds a fetched InfluxDB token is reused before Secrets Manager is queried again
+TOKEN_TTL = 3600
+
+# Connection pool sized for the concurrent bucket and file transfers, with adaptive retries
+S3_CONFIG = Config(
+    max_pool_connections=MAX_POOL_CONNECTIONS,
+    retries={"mode": "adaptive", "max_attempts": 5},
+    tcp_keepalive=True,
+    s3={"addressing_style": "virtual"}
+)
+
+# AWS clients and the token cache live at module scope so warm invocations reuse them
+secrets_client = boto3.client("secretsmanager")
+s3_client = boto3.client("s3", config=S3_CONFIG)
+token_cache = {}
 
 def get_influx_token(secret_arn):
-    """Fetch InfluxDB token from Secrets Manager."""
+    """Fetch InfluxDB token from Secrets Manager, reusing it across warm invocations."""
+    cached = token_cache.get(secret_arn)
+    if cached and time.monotonic() - cached[0] < TOKEN_TTL:
+        return cached[1]
     try:
-        secrets_client = boto3.client("secretsmanager")
         response = secrets_client.get_secret_value(SecretId=secret_arn)
-        return response["SecretString"]
     except ClientError as e:
-        logger.error(f"Failed to retrieve secret {secret_arn}: {str(e)}")
+        logger.error("Failed to retrieve secret %s: %s", secret_arn, e)
         raise
+    token_cache[secret_arn] = (time.monotonic(), response["SecretString"])
+    return response["SecretString"]
+
+def influx_env(influx_token):
+    """Build the influx CLI environment, passing the token via INFLUX_TOKEN instead of argv."""
+    return {**os.environ, "INFLUX_TOKEN": influx_token}
+
+def restore_bucket(bucket, s3_client, s3_bucket, influx_bin, influx_url, influx_org, influx_new_org, influx_token):
+    """Download a monthly backup of a single bucket and restore it into a new bucket, returning (name, ok)."""
+    bucket_name = bucket["name"]
+    dest_bucket = bucket["dest_bucket"]
+    s3_prefix = bucket["s3_path"]
+
+    # Per-bucket working directory, removed with its contents even if the restore fails
+    with tempfile.TemporaryDirectory(prefix=f"restore_{bucket_name}_", ignore_cleanup_errors=True) as restore_path:
+        # Download backup files from S3
+        logger.info("Downloading backup files for %s from s3://%s/%s", bucket_name, s3_bucket, s3_prefix)
+        try:
+            paginator = s3_client.get_paginator("list_objects_v2")
+            with create_transfer_manager(s3_client, TRANSFER_CONFIG) as manager:
+                # Start downloading each page of keys while the next page is being listed
+                downloads = [
+                    (obj["Key"], manager.download(s3_bucket, obj["Key"], os.path.join(restore_path, os.path.basename(obj["Key"]))))
+                    for page in paginator.paginate(Bucket=s3_bucket, Prefix=s3_prefix)
+                    for obj in page.get("Contents", [])
+                ]
+                for s3_key, future in downloads:
+                    future.result()
+                    logger.info("Downloaded %s to %s", os.path.basename(s3_key), restore_path)
+            if not downloads:
+                logger.warning("No backup files found for %s at %s", bucket_name, s3_prefix)
+                return dest_bucket, False
+        except ClientError as e:
+            logger.error("Failed to list or download files for %s: %s", bucket_name, e)
+            raise
+
+        # Run restore command with --new-bucket
+        logger.info("Restoring %s to new bucket %s from %s", bucket_name, dest_bucket, restore_path)
+        cmd = [
+            influx_bin, "restore", restore_path,
+            "--host", influx_url,
+            "--org", influx_org,
+            "--bucket", bucket_name,
+            "--new-org", influx_new_org,
+            "--new-bucket", dest_bucket
+        ]
+        result = subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, env=influx_env(influx_token), timeout=600)
+        if result.returncode != 0:
+            stderr = result.stderr.decode("utf-8", errors="replace")
+            logger.error("Restore failed for %s to %s: %s", bucket_name, dest_bucket, stderr)
+            raise Exception(f"Restore failed for {bucket_name}: {stderr}")
+
+        logger.info("Restored %s to %s", bucket_name, dest_bucket)
+        return dest_bucket, True
 
 def lambda_handler(event, context):
     try:
         # Initialize variables from environment
         influx_bin = "/opt/bin/influx"
-        restore_base_path = "/tmp/restore"
         influx_url = os.environ.get("INFLUXDB_URL")
         influx_token_secret_arn = os.environ.get("INFLUXDB_TOKEN")
         influx_org = os.environ.get("INFLUXDB_ORG")
@@ -39,8 +134,11 @@ def lambda_handler(event, context):
         backup_timestamp = event.get("backup_timestamp")
         if not backup_timestamp:
             raise ValueError("Missing 'backup_timestamp' in event (format: YYYYMMDDTHHMMSSZ)")
+        # Cheap shape check first; fromisoformat then rejects out-of-range fields without strptime's parser
+        if not BACKUP_TIMESTAMP_RE.fullmatch(backup_timestamp):
+            raise ValueError("Invalid 'backup_timestamp' format, expected YYYYMMDDTHHMMSSZ")
         try:
-            datetime.strptime(backup_timestamp, "%Y%m%dT%H%M%SZ")
+            datetime.fromisoformat(backup_timestamp)
         except ValueError:
             raise ValueError("Invalid 'backup_timestamp' format, expected YYYYMMDDTHHMMSSZ")
 
@@ -48,85 +146,29 @@ def lambda_handler(event, context):
         logger.info("Retrieving InfluxDB token from Secrets Manager")
         influx_token = get_influx_token(influx_token_secret_arn)
 
-        # S3 configuration
-        s3_client = boto3.client("s3")
-
         # Default bucket configuration if not provided in event or environment asset_bucket, cloud_bucket
         buckets = [
             {"name": "asset_bucket", "s3_path": f"influx-backups/monthly/{backup_timestamp}/asset_bucket/", "dest_bucket": "restored_asset_bucket"},
             {"name": "cloud_bucket", "s3_path": f"influx-backups/monthly/{backup_timestamp}/cloud_bucket/", "dest_bucket": "restored_cloud_bucket"}
         ]
 
-        # Create temporary directory
-        logger.info(f"Creating restore directory at {restore_base_path}")
-        os.makedirs(restore_base_path, exist_ok=True)
-
-        # Restore each bucket
-        restored_buckets = []
-        for bucket in buckets:
-            bucket_name = bucket["name"]
-            dest_bucket = bucket["dest_bucket"]
-            s3_prefix = bucket["s3_path"]
-            restore_path = f"{restore_base_path}/{bucket_name}"
-            os.makedirs(restore_path, exist_ok=True)
-
-            # Download backup files from S3
-            logger.info(f"Downloading backup files for {bucket_name} from s3://{s3_bucket}/{s3_prefix}")
-            try:
-                response = s3_client.list_objects_v2(Bucket=s3_bucket, Prefix=s3_prefix)
-                if "Contents" not in response:
-                    logger.warning(f"No backup files found for {bucket_name} at {s3_prefix}")
-                    continue
-                for obj in response["Contents"]:
-                    file_name = os.path.basename(obj["Key"])
-                    file_path = os.path.join(restore_path, file_name)
-                    s3_client.download_file(Bucket=s3_bucket, Key=obj["Key"], Filename=file_path)
-                    logger.info(f"Downloaded {file_name} to {file_path}")
-            except ClientError as e:
-                logger.error(f"Failed to list or download files for {bucket_name}: {str(e)}")
-                raise
-
-            # Run restore command with --new-bucket
-            logger.info(f"Restoring {bucket_name} to new bucket {dest_bucket} from {restore_path}")
-            cmd = [
-                influx_bin, "restore", restore_path,
-                "--host", influx_url,
-                "--org", influx_org,
-                "--token", influx_token,
-                "--bucket", bucket_name,
-                "--new-org", influx_new_org,
-                "--new-bucket", dest_bucket
-            ]
-            result = subprocess.run(cmd, capture_output=True, text=True, timeout=600)
-            if result.returncode != 0:
-                logger.error(f"Restore failed for {bucket_name} to {dest_bucket}: {result.stderr}")
-                raise Exception(f"Restore failed for {bucket_name}: {result.stderr}")
-
-            # Clean up restore directory
-            for file_name in os.listdir(restore_path):
-                file_path = os.path.join(restore_path, file_name)
-                try:
-                    os.remove(file_path)
-                    logger.debug(f"Deleted local file {file_path}")
-                except OSError as e:
-                    logger.warning(f"Failed to delete {file_path}: {str(e)}")
-            try:
-                os.rmdir(restore_path)
-                logger.debug(f"Deleted restore directory {restore_path}")
-            except OSError as e:
-                logger.warning(f"Failed to delete directory {restore_path}: {str(e)}")
-
-            logger.info(f"Restored {bucket_name} to {dest_bucket}")
-            restored_buckets.append(dest_bucket)
-
-        # Clean up base restore directory
-        try:
-            os.rmdir(restore_base_path)
-            logger.info(f"Removed temporary directory {restore_base_path}")
-        except OSError as e:
-            logger.warning(f"Failed to remove {restore_base_path}: {str(e)}")
-
-        logger.info(f"Restoration completed for {backup_timestamp} to buckets {restored_buckets}")
+        # Restore buckets concurrently; the work is dominated by S3 and influx CLI IO
+        worker = functools.partial(
+            restore_bucket,
+            s3_client=s3_client,
+            s3_bucket=s3_bucket,
+            influx_bin=influx_bin,
+            influx_url=influx_url,
+            influx_org=influx_org,
+            influx_new_org=influx_new_org,
+            influx_token=influx_token
+        )
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, min(MAX_WORKERS, len(buckets)))) as executor:
+            results = list(executor.map(worker, buckets))
+
+        restored_buckets = [name for name, ok in results if ok]
+
+        logger.info("Restoration completed for %s to buckets %s", backup_timestamp, restored_buckets)
         return {
             "statusCode": 200,
             "body": json.dumps({
@@ -136,13 +178,13 @@ def lambda_handler(event, context):
         }
 
     except subprocess.TimeoutExpired as e:
-        logger.error(f"Operation timed out: {str(e)}")
+        logger.error("Operation timed out: %s", e)
         return {
             "statusCode": 500,
             "body": json.dumps({"error": f"Operation timed out: {str(e)}"})
         }
     except Exception as e:
-        logger.error(f"Operation failed: {str(e)}")
+        logger.error("Operation failed: %s", e)
         return {
             "statusCode": 500,
             "body": json.dumps({"error": str(e)})
@@ -7,6 +7,16 @@ resource "aws_lambda_layer_version" "influxdb_cli_layer" {
   compatible_architectures = ["x86_64"]
 }
 
+#creating lambda layer with the zstandard package used by the daily backup and restore
+resource "aws_lambda_layer_version" "zstandard_layer" {
+  filename         = "${path.module}/zstandard-layer.zip"
+  layer_name       = "${var.projectName}-${var.environment}-zstandard"
+  source_code_hash = filebase64sha256("${path.module}/zstandard-layer.zip")
+
+  compatible_runtimes      = ["python3.13"]
+  compatible_architectures = ["x86_64"]
+}
+
 # 8. IAM Role for Lambda
 resource "aws_iam_role" "lambda_execution_role" {
   name = "${var.projectName}-${var.environment}-lambda_exec_role"
@@ -35,7 +45,7 @@ resource "aws_iam_role_policy" "lambda_backup_s3_policy" {
     Statement = [
       {
         Effect = "Allow"
-        Action = ["s3:PutObject", "s3:ListBucket", "s3:GetObject"]
+        Action = ["s3:PutObject", "s3:ListBucket", "s3:GetObject", "s3:AbortMultipartUpload"]
         Resource = [
           "${var.s3_bucket_arn}",
           "${var.s3_bucket_arn}/*" 
@@ -102,7 +112,7 @@ resource "aws_lambda_function" "influxdb_daily_backup" {
   timeout          = 900
   memory_size      = 512                                                
   source_code_hash = filebase64sha256("${path.module}/influxdb_daily_backup.zip")
-  layers           = [aws_lambda_layer_version.influxdb_cli_layer.arn]
+  layers           = [aws_lambda_layer_version.zstandard_layer.arn]
 
   ephemeral_storage {
     size = 2048 # Increase to 2 GB (adjust as needed)
@@ -171,11 +181,11 @@ resource "aws_lambda_function" "influxdb_daily_restore" {
   function_name    = "${var.projectName}-${var.environment}-influxdb-daily-restore"
   role             = aws_iam_role.lambda_execution_role.arn
   handler          = "influxdb_daily_restore.lambda_handler"
-  runtime          = "python3.9"
+  runtime          = "python3.13"
   timeout          = 600
   memory_size      = 2048                        # very memory intensive process
   source_code_hash = filebase64sha256("${path.module}/influxdb_daily_restore.zip")
-  layers           = [aws_lambda_layer_version.influxdb_cli_layer.arn]
+  layers           = [aws_lambda_layer_version.influxdb_cli_layer.arn, aws_lambda_layer_version.zstandard_layer.arn]
 
   ephemeral_storage {
     size = 8192